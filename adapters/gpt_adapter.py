@@ -1,27 +1,56 @@
 import os
+import json
+import hashlib
+from collections import OrderedDict
 from typing import Optional, List
 
 import openai
-from dotenv import load_dotenv
 
-load_dotenv()
+from env import ensure_env
+
+ensure_env()
+
+# Number of distinct (model, conversation) requests whose responses are kept in memory
+RESPONSE_CACHE_SIZE = 512
+
+# User/assistant exchanges kept in the history sent to the API, older ones are dropped (the system prompt is always kept)
+MAX_TURNS = 10
+
+
+# The head is only kept when it is the system prompt, a history without one is trimmed to the last turns
+def trim_history(messages: List[dict]) -> List[dict]:
+    if len(messages) <= 1 + 2 * MAX_TURNS:
+        return messages
+    if messages[0]["role"] == "system":
+        return [messages[0]] + messages[-2 * MAX_TURNS:]
+    return messages[-2 * MAX_TURNS:]
 
 
 # TODO refactor the methods of this class into something more idiomatic, it should be cleaner
 # TODO find ways to "clear" the conversation, currently it's reusing everything
 class OpenAI:
-    def __init__(self, api_key=os.getenv("OPEN_AI_API_KEY"), model: Optional[str] = None):
-        # Set up OpenAI API key
-        openai.api_key = api_key
+    def __init__(self, api_key: Optional[str] = None, model: Optional[str] = None):
+        # Each adapter owns its client (and its pooled connections) instead of mutating the global openai.api_key
+        self._client = openai.OpenAI(api_key=api_key or os.getenv("OPEN_AI_API_KEY"))
         self.messages: Optional[List[dict]] = None  # TODO review how this message history works, it should be easier to cleaj
         self.model = model or "gpt-3.5-turbo"
+        # LRU of responses keyed by a hash of the model and the full message log, repeated requests skip the API call
+        self._response_cache: "OrderedDict[str, str]" = OrderedDict()
 
     # Function to send a message to the OpenAI chatbot model and return its response
     def send_message(self, message_log, model: Optional[str] = None) -> str:
-        # Use OpenAI's ChatCompletion API to get the chatbot's response
+        # Use OpenAI's Chat Completions API to get the chatbot's response
         if model is None:
             model = self.model
-        response = openai.ChatCompletion.create(
+
+        cache_key = hashlib.blake2b(json.dumps([model, message_log], sort_keys=True).encode()).hexdigest()
+        cached_response = self._response_cache.get(cache_key)
+        if cached_response is not None:
+            self._response_cache.move_to_end(cache_key)
+            return cached_response
+
+        # Only successful responses reach the cache, an API error propagates without storing anything
+        response = self._client.chat.completions.create(
             model=model,  # The name of the OpenAI chatbot model to use
             messages=message_log,  # The conversation history up to this point, as a list of dictionaries
             # max_tokens=4096,        # The maximum number of tokens (words or subwords) in the generated response
@@ -29,13 +58,12 @@ class OpenAI:
             temperature=0.7,  # The "creativity" of the generated response (higher temperature = more creative)
         )
 
-        # Find the first response from the chatbot that has text in it (some responses may not have text)
-        for choice in response.choices:
-            if "text" in choice:
-                return choice.text
-
-        # If no response with text is found, return the first response's content (which may be empty)
-        return response.choices[0].message.content
+        # Chat completions always carry the reply in message.content, the legacy "text" field only exists on Completions
+        content = response.choices[0].message.content
+        self._response_cache[cache_key] = content
+        if len(self._response_cache) > RESPONSE_CACHE_SIZE:
+            self._response_cache.popitem(last=False)
+        return content
 
     def process_message(self, message, model: Optional[str] = None) -> None:
         # Set a flag to keep track of whether this is the first request in the conversation
@@ -57,6 +85,7 @@ class OpenAI:
 
         response = self.send_message(self.messages, model=model)
         self.messages.append({"role": "assistant", "content": response})
+        self.messages = trim_history(self.messages)
 
     def answer_message(self, message, model: Optional[str] = None) -> str:
         self.process_message(message, model=model)
@@ -3,9 +3,13 @@ from typing import Optional, List
 
 import openai
 
+from adapters.gpt_adapter import trim_history
+
 # TODO this is an attempt to make the adapter more idiomatic, it's not being used
 
 class Message:
+    __slots__ = ("role", "content")
+
     def __init__(self, role: str, content: str):
         self.role = role
         self.content = content
@@ -15,45 +19,49 @@ class Message:
 
 
 class Conversation:
+    __slots__ = ("messages",)
+
+    # Messages are stored already in the dict form the API expects, so sending them needs no conversion
     def __init__(self, initial_system_message: str = "You are a helpful assistant."):
-        self.messages = [Message("system", initial_system_message)]
+        self.messages: List[dict] = [Message("system", initial_system_message).to_dict()]
+
+    # Drops the history but keeps the system prompt, so the next request still carries it
+    def clear(self):
+        self.messages = self.messages[:1] if self.messages and self.messages[0]["role"] == "system" else []
 
     def add_user_message(self, content: str):
-        self.messages.append(Message("user", content))
+        self.messages.append(Message("user", content).to_dict())
 
     def add_assistant_message(self, content: str):
-        self.messages.append(Message("assistant", content))
+        self.messages.append(Message("assistant", content).to_dict())
+        self.messages = trim_history(self.messages)
 
     def to_dict_list(self):
-        return [msg.to_dict() for msg in self.messages]
+        return self.messages
 
 
 class OpenAIAdapter:
-    def __init__(self, api_key=os.getenv("OPEN_AI_API_KEY"), model: Optional[str] = None):
-        openai.api_key = api_key
+    def __init__(self, api_key: Optional[str] = None, model: Optional[str] = None):
+        self._client = openai.OpenAI(api_key=api_key or os.getenv("OPEN_AI_API_KEY"))
         self.model = model or "gpt-3.5-turbo"
 
     def _send_message(self, message_log, model: Optional[str] = None) -> str:
         if model is None:
             model = self.model
-        response = openai.ChatCompletion.create(
+        response = self._client.chat.completions.create(
             model=model,
             messages=message_log,
             temperature=0.7,
         )
 
-        for choice in response.choices:
-            if "text" in choice:
-                return choice.text
-
         return response.choices[0].message.content
 
     def process_message(self, conversation: Conversation, message: str, model: Optional[str] = None) -> None:
         if message.lower() == "quit":
-            conversation.messages = []
+            conversation.clear()
             return
         if message[:6] == "/clean":
-            conversation.messages = []
+            conversation.clear()
             message = message[6:]
         conversation.add_user_message(message)
 
@@ -62,7 +70,7 @@ class OpenAIAdapter:
 
     def answer_message(self, conversation: Conversation, message: str, model: Optional[str] = None) -> str:
         self.process_message(conversation, message, model=model)
-        return f"{conversation.messages[-1].content} \nmessage #{len(conversation.messages)}"
+        return f"{conversation.messages[-1]['content']} \nmessage #{len(conversation.messages)}"
 
 
 if __name__ == '__main__':
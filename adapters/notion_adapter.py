@@ -1,56 +1,67 @@
 import os
 from datetime import datetime
-from typing import Optional
-from dotenv import load_dotenv
-from notion_client import Client
+from typing import Optional, Iterable, List
+from notion_client import AsyncClient
 
-load_dotenv()
+from env import ensure_env
+
+ensure_env()
+
+
+def _paragraph_block(text: str) -> dict:
+    return {
+        "object": "block",
+        "type": "paragraph",
+        "paragraph": {
+            "rich_text": [{"type": "text", "text": {"content": text}}]
+        }
+    }
+
+
+def _bulleted_list_item_block(text: str) -> dict:
+    return {
+        "object": "block",
+        "type": "bulleted_list_item",
+        "bulleted_list_item": {
+            "rich_text": [{"type": "text", "text": {"content": text}}],
+            "color": "default",
+            "children": []
+        }
+    }
+
+
+# Builders for the supported block types, each returns a fresh dict ready to be sent to Notion
+_BLOCK_BUILDERS = {
+    "paragraph": _paragraph_block,
+    "bulleted_list_item": _bulleted_list_item_block,
+}
+
+# Notion accepts at most this many children per append request
+_MAX_CHILDREN_PER_APPEND = 100
+
+
+def _block_builder(block_type: str):
+    block_builder = _BLOCK_BUILDERS.get(block_type)
+    if block_builder is None:
+        raise ValueError("Invalid block_type. Must be 'paragraph' or 'bulleted_list_item'.")
+    return block_builder
 
 
 class NotionAdapter:
-    def __init__(self, auth_token: str = os.getenv("NOTION_TOKEN"), database_id: Optional[str] = None):
-        self._client = Client(auth=auth_token)
+    def __init__(self, auth_token: Optional[str] = None, database_id: Optional[str] = None):
+        auth_token = auth_token or os.getenv("NOTION_TOKEN")
+        self._client = AsyncClient(auth=auth_token)
         # self._db = database_id or self._client.databases.retrieve(database_id)
 
-    from datetime import datetime
+    async def aclose(self) -> None:
+        await self._client.aclose()
 
-    def add_block(self, parent_id: str, text: str, date: datetime = None, attachment_url: str = None,
-                  block_type: str = "paragraph"):
+    async def add_block(self, parent_id: str, text: str, date: datetime = None, attachment_url: str = None,
+                        block_type: str = "paragraph"):
         if date is None:
             date = datetime.now()
 
-        if block_type not in ["paragraph", "bulleted_list_item"]:
-            raise ValueError("Invalid block_type. Must be 'paragraph' or 'bulleted_list_item'.")
-
-        block_dict = {
-            "object": "block",
-            "type": block_type,
-        }
-
-        if block_type == "paragraph":
-            block_dict["paragraph"] = {
-                "rich_text": [
-                    {
-                        "type": "text",
-                        "text": {
-                            "content": text
-                        }
-                    }
-                ]
-            }
-        elif block_type == "bulleted_list_item":
-            block_dict["bulleted_list_item"] = {
-                "rich_text": [
-                    {
-                        "type": "text",
-                        "text": {
-                            "content": text
-                        }
-                    }
-                ],
-                "color": "default",
-                "children": []
-            }
+        block_dict = _block_builder(block_type)(text)
 
         if attachment_url:
             attachment_block = {
@@ -62,6 +73,17 @@ class NotionAdapter:
             }
             block_dict[block_type]['rich_text'].append(attachment_block)
 
-        ret = self._client.blocks.children.append(parent_id, children=[block_dict])
+        ret = await self._client.blocks.children.append(parent_id, children=[block_dict])
 
         return ret
+
+    async def add_blocks(self, parent_id: str, texts: Iterable[str], block_type: str = "paragraph") -> List[dict]:
+        # Appends one block per text with as few requests as possible, in order, up to 100 children each
+        block_builder = _block_builder(block_type)
+        blocks = [block_builder(text) for text in texts]
+
+        results = []
+        for start in range(0, len(blocks), _MAX_CHILDREN_PER_APPEND):
+            children = blocks[start:start + _MAX_CHILDREN_PER_APPEND]
+            results.append(await self._client.blocks.children.append(parent_id, children=children))
+        return results
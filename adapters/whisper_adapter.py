@@ -1,45 +1,111 @@
 import os
 import re
-from typing import List
-import requests
-from dotenv import load_dotenv
+import asyncio
+import logging
+import random
+from typing import List, Iterable, Iterator, BinaryIO
+import httpx
 
-load_dotenv()
+from env import ensure_env
 
+ensure_env()
 
-# TODO convert to class
-def transcribe_audio_file(local_file_path: str) -> List[str]:
-    # Send the audio file to the OpenAI API endpoint
-    openai_api_key = os.getenv("OPEN_AI_API_KEY")
-    headers = {
-        "Authorization": f"Bearer {openai_api_key}",
-    }
-    url = "https://api.openai.com/v1/audio/transcriptions"
-    model = "whisper-1"
-
-    with open(local_file_path, "rb") as audio_data:
-        files = {"file": (local_file_path, audio_data)}
-        data = {"model": model}
-        response = requests.post(url, headers=headers, data=data, files=files)
+# Splits text into sentences at the spaces following '.', '!' or '?'
+_SENTENCE_SPLIT_RE = re.compile(r"(?<=[.!?]) +")
+
+_OPENAI_API_KEY = os.getenv("OPEN_AI_API_KEY")
+if _OPENAI_API_KEY is None:
+    raise ValueError("OPEN_AI_API_KEY is required for Whisper transcriptions")
+
+_URL = "https://api.openai.com/v1/audio/transcriptions"
+_DATA = {"model": "whisper-1", "response_format": "json"}
+
+# Shared async client so uploads reuse the keep-alive connection to api.openai.com without blocking the event loop
+_CLIENT = httpx.AsyncClient(headers={"Authorization": f"Bearer {_OPENAI_API_KEY}"}, timeout=120)
+
+# Caps the number of uploads in flight, so parallel transcriptions stay within the API rate limit
+_TRANSCRIBE_SEMAPHORE = asyncio.Semaphore(int(os.getenv("WHISPER_MAX_CONCURRENCY", "4")))
+
+# Retry policy for rate-limited (429) and server-side (5xx) failures
+_MAX_ATTEMPTS = 5
+_BASE_RETRY_DELAY = 1.0
+_MAX_RETRY_DELAY = 60.0
+
+
+def _is_retryable_status(status_code: int) -> bool:
+    return status_code == 429 or 500 <= status_code < 600
+
+
+def _retry_delay(response: httpx.Response, attempt: int) -> float:
+    # Prefer the server's Retry-After (in seconds) when it is a positive number, otherwise use exponential backoff
+    # with jitter so concurrent uploads don't retry in lockstep
+    retry_after = response.headers.get("Retry-After")
+    if retry_after is not None:
+        try:
+            retry_after_seconds = float(retry_after)
+        except ValueError:
+            retry_after_seconds = 0.0
+        if retry_after_seconds > 0:
+            return min(_MAX_RETRY_DELAY, retry_after_seconds)
+    return min(_MAX_RETRY_DELAY, _BASE_RETRY_DELAY * 2 ** attempt) + random.uniform(0, _BASE_RETRY_DELAY)
 
-    response_text = response.json()["text"]
 
-    # Split the response text into sentences using a regular expression
-    sentences = re.split("(?<=[.!?]) +", response_text)
+def _iter_sentences(text: str) -> Iterator[str]:
+    # Yields the same pieces as _SENTENCE_SPLIT_RE.split(text), without building the whole list up front
+    last = 0
+    for match in _SENTENCE_SPLIT_RE.finditer(text):
+        yield text[last:match.start()]
+        last = match.end()
+    yield text[last:]
 
-    # Combine the sentences into messages of no more than 1000 characters each
+
+def _pack_sentences(sentences: Iterable[str], max_length: int) -> List[str]:
+    # Greedily pack sentences into messages, buffering parts so each message is joined only once.
+    # A single sentence longer than max_length gets a message of its own
     messages = []
-    current_message = ""
-    for sentence in sentences[:-1]:
-        if len(current_message) + len(sentence) <= 1000:
-            current_message += sentence
-        else:
-            messages.append(current_message)
-            current_message = sentence
-    if len(current_message) > 1000:
-        messages.append(current_message)
-        current_message = ""
-    messages.append(current_message + sentences[-1])
+    parts: List[str] = []
+    length = 0
+    for sentence in sentences:
+        added_length = len(sentence) + (1 if parts else 0)  # Account for the joining space
+        if parts and length + added_length > max_length:
+            messages.append(" ".join(parts))
+            parts = []
+            length = 0
+            added_length = len(sentence)
+        parts.append(sentence)
+        length += added_length
+    if parts:
+        messages.append(" ".join(parts))
+    return messages
+
+
+# TODO convert to class
+async def transcribe_audio(audio_data: BinaryIO, file_name: str, max_length: int = 1000) -> List[str]:
+    # Send the audio to the OpenAI API endpoint, file_name's extension tells Whisper the audio format
+    for attempt in range(_MAX_ATTEMPTS):
+        # httpx streams the file object into the multipart body in chunks rather than buffering it again
+        async with _TRANSCRIBE_SEMAPHORE:
+            audio_data.seek(0)  # A retry has to upload the audio from the start again
+            files = {"file": (file_name, audio_data)}
+            response = await _CLIENT.post(_URL, data=_DATA, files=files)
+
+        if not _is_retryable_status(response.status_code) or attempt == _MAX_ATTEMPTS - 1:
+            break
+        delay = _retry_delay(response, attempt)
+        logging.warning("Whisper request failed with status %s (attempt %d/%d), retrying in %.1fs",
+                        response.status_code, attempt + 1, _MAX_ATTEMPTS, delay)
+        await asyncio.sleep(delay)
+
+    response.raise_for_status()
+    response_text = response.json()["text"]
+
+    # Split the response text into sentences and combine them into messages of no more than max_length characters each
+    messages = _pack_sentences(_iter_sentences(response_text), max_length=max_length)
 
     # Send each message as a separate message
     return messages
+
+
+async def aclose() -> None:
+    # The shared client outlives single requests, the bot closes it on shutdown to release its pooled connections
+    await _CLIENT.aclose()
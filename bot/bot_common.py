@@ -1,28 +1,47 @@
 import os
+import re
+import secrets
 import logging
-from typing import List, Callable, Coroutine, TypeVar, Any, Dict, Optional
+from itertools import groupby
+from typing import List, Callable, Coroutine, TypeVar, Any, Dict, Optional, FrozenSet, Tuple, Set, Iterable, Union
 
 import asyncio
-#from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
-from dotenv import load_dotenv
+from env import ensure_env
 from telegram.ext import ApplicationBuilder, ContextTypes, Application
 from telegram import Update, Bot
+from telegram.request import HTTPXRequest
 
 from bot.bot_lookup import bots_lookup
+from bot.bot_conditions import condition_catch_all
 from bot.bot_types import ReplyAction, Condition
 
-load_dotenv()  # Python module to load environment variables from a .env file
+ensure_env()  # Loads environment variables from the .env file, once per process
 
 # Configure logging (native python library)
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
     level=logging.INFO
 )
+logger = logging.getLogger(__name__)
 
-allowed_chat_ids: List[int] = [int(chat_id) for chat_id in os.getenv('ALLOWED_CHAT_IDS').split(',')]
+# A frozenset makes the per-update membership check O(1)
+allowed_chat_ids: FrozenSet[int] = frozenset(int(chat_id) for chat_id in (os.getenv('ALLOWED_CHAT_IDS') or '').split(',')
+                                               if chat_id.strip())
 chat_ids_report: List[int] = [int(chat_id) for chat_id in os.getenv('STARTUP_CHAT_IDS_REPORT').split(',')]
 
+# Long-poll getUpdates so idle bots hold one request open instead of firing many short ones,
+# and keep retrying the startup connection instead of exiting on a transient network error
+POLLING_KWARGS: Dict[str, Any] = {"timeout": 20, "poll_interval": 0.0, "bootstrap_retries": -1}
+
+# Outbound Bot API calls keep python-telegram-bot's default pool size, getUpdates already runs on its own pool
+# so broadcasts never wait behind the long poll. A burst of sends waits up to this long for a free connection
+TG_POOL_TIMEOUT = 10.0
+
+# Webhook mode lets Telegram push updates instead of keeping a getUpdates long poll open.
+# It needs a public HTTPS URL (PUBLIC_URL) and the python-telegram-bot[webhooks] extra
+USE_WEBHOOK = os.getenv("USE_WEBHOOK", "").lower() in ("1", "true", "yes")
+
 
 def allowed_user(update: Update) -> bool:
     return update.effective_chat.id in allowed_chat_ids
@@ -30,22 +49,128 @@ def allowed_user(update: Update) -> bool:
 
 def bot_start(welcome_message: str) -> Callable[[Update, ContextTypes.DEFAULT_TYPE], Coroutine]:
     async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-        if allowed_user(update):
+        if update.effective_chat.id in allowed_chat_ids:
             await update.message.reply_text(welcome_message)
 
     return start_command
 
 
+# Flags of a pattern without inline flags, patterns compiled with anything else are never merged
+_DEFAULT_RE_FLAGS = re.compile("").flags
+
+# A stage takes the received text and returns the action to run, or None to fall through to the next stage
+Stage = Callable[[str], Optional[ReplyAction]]
+
+
+def _condition_kind(condition: Condition) -> Optional[str]:
+    if hasattr(condition, "lower_value"):
+        return "exact"
+    if hasattr(condition, "prefix"):
+        return "prefix"
+    if hasattr(condition, "pattern"):
+        compiled = re.compile(condition.pattern)
+        # Only group-free patterns can be wrapped in a named group without shifting their own group numbers, and
+        # only flag-free ones can share an alternation: a global inline flag such as (?i) is an error mid-pattern
+        # on Python 3.11+, but on 3.10 it is only a DeprecationWarning and applies to every merged pattern
+        if compiled.groups == 0 and compiled.flags == _DEFAULT_RE_FLAGS:
+            return "regex"
+    return None
+
+
+def _exact_stage(pairs: List[Tuple[Condition, ReplyAction]]) -> Stage:
+    exact_actions: Dict[str, ReplyAction] = {}
+    for condition, action in pairs:
+        exact_actions.setdefault(condition.lower_value, action)
+
+    def stage(text: str) -> Optional[ReplyAction]:
+        return exact_actions.get(text.lower())
+    return stage
+
+
+def _prefix_stage(pairs: List[Tuple[Condition, ReplyAction]]) -> Stage:
+    # One dict per prefix length, mapping the lowercased prefix to (position, action). Every length is looked up
+    # and the hit with the lowest position wins, the same one the conditions would pick in order
+    prefix_tables: Dict[int, Dict[str, Tuple[int, ReplyAction]]] = {}
+    for position, (condition, action) in enumerate(pairs):
+        length, lowered = condition.prefix
+        prefix_tables.setdefault(length, {}).setdefault(lowered, (position, action))
+    prefix_tables_items = tuple(prefix_tables.items())
+
+    def stage(text: str) -> Optional[ReplyAction]:
+        best: Optional[Tuple[int, ReplyAction]] = None
+        for length, table in prefix_tables_items:
+            hit = table.get(text[:length].lower())
+            if hit is not None and (best is None or hit[0] < best[0]):
+                best = hit
+        return best[1] if best is not None else None
+    return stage
+
+
+def _regex_stage(pairs: List[Tuple[Condition, ReplyAction]]) -> Stage:
+    # An alternation tries its branches left to right, so the first matching pattern still wins
+    combined = re.compile("|".join(f"(?P<c{i}>{condition.pattern})" for i, (condition, _) in enumerate(pairs)))
+    group_actions = {f"c{i}": action for i, (_, action) in enumerate(pairs)}
+
+    def stage(text: str) -> Optional[ReplyAction]:
+        match = combined.match(text)
+        return group_actions[match.lastgroup] if match else None
+    return stage
+
+
+def _condition_stage(condition: Condition, action: ReplyAction) -> Stage:
+    def stage(text: str) -> Optional[ReplyAction]:
+        return action if condition(text) else None
+    return stage
+
+
+def _build_stages(actions: Dict[Condition, ReplyAction]) -> Tuple[Tuple[Stage, ...], Optional[ReplyAction]]:
+    # Nothing after the catch-all condition can ever be reached, so its action becomes the fallback
+    # instead of a stage that is evaluated on every unmatched message
+    pairs: List[Tuple[Condition, ReplyAction]] = []
+    fallback: Optional[ReplyAction] = None
+    for condition, action in actions.items():
+        if condition is condition_catch_all:
+            fallback = action
+            break
+        pairs.append((condition, action))
+
+    # Consecutive conditions of the same kind are merged into a single stage, keeping the insertion order across
+    # stages so the first matching condition still wins
+    stages: List[Stage] = []
+    for kind, group in groupby(pairs, key=lambda pair: _condition_kind(pair[0])):
+        pairs_of_kind = list(group)
+        if kind == "exact":
+            stages.append(_exact_stage(pairs_of_kind))
+        elif kind == "prefix":
+            stages.append(_prefix_stage(pairs_of_kind))
+        elif kind == "regex":
+            stages.append(_regex_stage(pairs_of_kind))
+        else:
+            stages.extend(_condition_stage(condition, action) for condition, action in pairs_of_kind)
+    return tuple(stages), fallback
+
+
 def reply_builder(actions: Dict[Condition, ReplyAction]) -> ReplyAction:
+    # Lower-case exact matches become one dict lookup, lower-case prefixes one lookup per prefix length and runs of
+    # regex conditions one combined match, instead of calling every condition per message
+    stages, fallback = _build_stages(actions)
+
     async def reply(update: Update, context: ContextTypes.DEFAULT_TYPE):
-        if allowed_user(update):
-            logging.info(f"Replying message from verified user")
+        # allowed_user inlined, this runs on every text update
+        if update.effective_chat.id in allowed_chat_ids:
+            logger.info("Replying message from verified user")
             received_message_text = update.message.text
 
-            for condition, action in actions.items():
-                if condition(received_message_text):
-                    await action(update, context)
+            # With only a catch-all there are no stages and the fallback runs straight away
+            for stage in stages:
+                action = stage(received_message_text)
+                if action is not None:
                     break
+            else:
+                action = fallback
+
+            if action is not None:
+                await action(update, context)
             else:
                 await update.message.reply_text("I don't know how to answer to that")
 
@@ -53,48 +178,103 @@ def reply_builder(actions: Dict[Condition, ReplyAction]) -> ReplyAction:
 
 
 def build_bot(token: str) -> Application:
-    return ApplicationBuilder().token(token).build()
+    return ApplicationBuilder().token(token).pool_timeout(TG_POOL_TIMEOUT).build()
 
 
 Handler = TypeVar("Handler", bound=Any)
 
-async def send_startup_message(token: str, chat_id: int, message: str):
-    bot = Bot(token)
-    await bot.send_message(chat_id, message)
+async def broadcast(bot: Union[Bot, "TelegramBot"], chat_ids: Iterable[int], text: str, **kwargs):
+    # Sends to every chat concurrently, a slow or failing chat doesn't hold back or cancel the others
+    chat_ids = list(chat_ids)
+    results = await asyncio.gather(*(bot.send_message(chat_id, text, **kwargs) for chat_id in chat_ids),
+                                   return_exceptions=True)
+    for chat_id, result in zip(chat_ids, results):
+        if isinstance(result, Exception):
+            logger.error("Error sending message to chat %s: %s", chat_id, result)
+
+
+def token_fingerprint(token: str) -> str:
+    return f"{token[:4]}..{token[-4:]}"
+
 
+# Strong references to fire-and-forget tasks, the event loop only keeps weak ones
+_background_tasks: Set[asyncio.Task] = set()
 
-def run_telegram_bot(token: str, handlers: List[Handler], scheduled_tasks: Optional[List[Dict[str, Any]]] = None):
+
+def _startup_report_done(task: asyncio.Task):
+    _background_tasks.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logger.error("Error sending startup messages: %s", task.exception())
+
+
+def announce_startup(bot: Bot, fingerprint: str, bot_name: Optional[str]) -> Callable[[Application], Coroutine]:
+    # Shared by run_telegram_bot and TelegramBot.run: logs the init message and returns the post_init hook that
+    # sends every startup report, in the background so polling starts without waiting on them
+    machine = os.environ.get('THIS_MACHINE')
+    logger.info("Running telegram bot %s - %s on Machine %s", fingerprint, bot_name, machine)
+    # TODO this should print which bot code is running, not where it's hosted
+    message = f"Running {bot_name} on {machine}"
+
+    async def send_startup_report(_: Application):
+        task = asyncio.create_task(broadcast(bot, chat_ids_report, message))
+        _background_tasks.add(task)
+        task.add_done_callback(_startup_report_done)
+
+    return send_startup_report
+
+
+def run_application(application: Application):
+    if USE_WEBHOOK:
+        public_url = (os.getenv("PUBLIC_URL") or "").rstrip("/")
+        if not public_url:
+            # Fail at startup, bootstrap_retries=-1 would otherwise retry an invalid setWebhook forever
+            raise ValueError("PUBLIC_URL is required when USE_WEBHOOK is set")
+        url_path = os.getenv("WEBHOOK_PATH", "telegram-webhook").strip("/")
+        # Telegram sends this secret in a header with every update, so the bot token never appears in the URL.
+        # Without a configured one a random secret is used, the webhook is registered again on every start anyway
+        secret_token = os.getenv("WEBHOOK_SECRET_TOKEN") or secrets.token_urlsafe(32)
+        # max_connections caps the concurrent update deliveries Telegram opens, size it to the expected update rate
+        application.run_webhook(listen="0.0.0.0", port=int(os.getenv("PORT", "8443")), url_path=url_path,
+                                webhook_url=f"{public_url}/{url_path}", secret_token=secret_token,
+                                max_connections=int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40")),
+                                bootstrap_retries=-1)
+    else:
+        application.run_polling(**POLLING_KWARGS)
+
+
+def run_telegram_bot(token: str, handlers: List[Handler], scheduled_tasks: Optional[List[Dict[str, Any]]] = None,
+                     post_shutdown: Optional[Callable[[Application], Coroutine]] = None):
     # This comes directly from the telegram bot library
     bot = build_bot(token)
 
     # The telegram bot manages events to process through handlers:
     # For each handled event group, the relevant function (defined above) will be invoked
-    for handler in handlers:
-        bot.add_handler(handler)
+    bot.add_handlers(handlers)
 
     # The app will be running constantly checking for new events
 
-    bot_token_fingerprint = f"{token[:4]}..{token[-4:]}"
-    init_message = f"Running telegram bot {bot_token_fingerprint} - {bots_lookup.get(bot_token_fingerprint)} on Machine" \
-                   f" {os.environ.get('THIS_MACHINE')}"
-    logging.info(init_message)
-
-    loop = asyncio.get_event_loop()
-    # TODO this should print which bot code is running, not where it's hosted
-    for chat_id in chat_ids_report:
-        loop.run_until_complete(send_startup_message(token, chat_id, f"Running {bots_lookup.get(bot_token_fingerprint)} on {os.environ.get('THIS_MACHINE')}"))
+    fingerprint = token_fingerprint(token)
+    bot.post_init = announce_startup(bot.bot, fingerprint, bots_lookup.get(fingerprint))
+    if post_shutdown is not None:
+        bot.post_shutdown = post_shutdown
 
-    bot.run_polling()
+    run_application(bot)
 
 
 class TelegramBot:
+    # Fixed attribute set, subclasses that need extra attributes must declare their own __slots__
+    __slots__ = ("token", "_fingerprint", "_bot_name", "handlers", "bot", "application", "scheduler")
+
     def __init__(self, token: str, handlers: Optional[List[Any]] = None):
         self.token = token
+        self._fingerprint = token_fingerprint(token)
+        self._bot_name = bots_lookup.get(self._fingerprint)
         if handlers is None:
             handlers = []
         self.handlers: List = handlers
-        self.bot = Bot(token)
+        self.bot = Bot(token, request=HTTPXRequest(pool_timeout=TG_POOL_TIMEOUT))
         self.application = build_bot(token)
+        # Jobs run as coroutines on the bot's loop, the scheduler binds to it when started from post_init
         self.scheduler = AsyncIOScheduler()
 
     def add_handler(self, handler):
@@ -104,27 +284,27 @@ class TelegramBot:
         return await self.bot.send_message(chat_id, text, **kwargs)
 
     def schedule_task(self, task_func: Callable, schedule: str, timezone: str, args: list):
-        hour, minute = schedule.split(':')
-        self.scheduler.add_job(task_func, 'cron', args=args, day_of_week='mon-fri', hour=int(hour), minute=int(minute),
+        hour, minute = map(int, schedule.split(':'))
+        self.scheduler.add_job(task_func, 'cron', args=args, day_of_week='mon-fri', hour=hour, minute=minute,
                                timezone=timezone)
 
+    def start_scheduler(self):
+        # Safe to call more than once, jobs added after the start are picked up by the running scheduler
+        if not self.scheduler.running:
+            self.scheduler.start()
+
     def run(self):
-        for handler in self.handlers:
-            self.application.add_handler(handler)
-
-        bot_token_fingerprint = f"{self.token[:4]}..{self.token[-4:]}"
-        init_message = f"Running telegram bot {bot_token_fingerprint} - {bots_lookup.get(bot_token_fingerprint)} on Machine" \
-                       f" {os.environ.get('THIS_MACHINE')}"
-        logging.info(init_message)
-
-        loop = asyncio.get_event_loop()
-        for chat_id in chat_ids_report:
-            loop.run_until_complete(send_startup_message(self.token, chat_id,
-                                                         f"Running {bots_lookup.get(bot_token_fingerprint)} on "
-                                                         f"{os.environ.get('THIS_MACHINE')}"))
-
-        self.scheduler.start()
-        self.application.run_polling()
+        self.application.add_handlers(self.handlers)
+
+        send_startup_report = announce_startup(self.bot, self._fingerprint, self._bot_name)
+
+        async def post_init(application: Application):
+            # The application's loop is running here, so the scheduler picks it up without get_event_loop()
+            self.start_scheduler()
+            await send_startup_report(application)
+
+        self.application.post_init = post_init
+        run_application(self.application)
 
 
     def stop(self):
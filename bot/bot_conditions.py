@@ -1,44 +1,63 @@
 import re
+from functools import lru_cache
 from bot.bot_types import Condition
 
 
+@lru_cache(maxsize=256)
 def lower_match_factory(value: str) -> Condition:
+    lowered = value.lower()
+
     def exact_match(text: str) -> bool:
-        return text.lower() == value.lower()
+        return text.lower() == lowered
+    # Exposes the matched value so reply_builder can dispatch these conditions with a dict lookup
+    exact_match.lower_value = lowered
     return exact_match
 
 
+@lru_cache(maxsize=256)
 def exact_match_factory(value: str) -> Condition:
     def exact_match(text: str) -> bool:
         return text == value
     return exact_match
 
 
+@lru_cache(maxsize=256)
 def first_chars_lower_factory(length: int, value: str) -> Condition:
+    lowered = value.lower()
+
     def first_chars_lower(text: str) -> bool:
-        return text[:length].lower() == value.lower()
+        return text[:length].lower() == lowered
+    # Exposes the prefix so reply_builder can dispatch these conditions with a lookup per prefix length
+    first_chars_lower.prefix = (length, lowered)
     return first_chars_lower
 
 
+@lru_cache(maxsize=256)
 def first_chars_exact_factory(length: int, value: str) -> Condition:
     def first_chars_exact(text: str) -> bool:
         return text[:length] == value
     return first_chars_exact
 
 
+@lru_cache(maxsize=256)
 def regex_match_factory(pattern: str) -> Condition:
+    match = re.compile(pattern).match
+
     def regex_match(text: str) -> bool:
-        return bool(re.match(pattern, text))
+        return match(text) is not None
+    # Exposes the pattern so reply_builder can combine consecutive regex conditions into a single match
+    regex_match.pattern = pattern
     return regex_match
 
 
+@lru_cache(maxsize=256)
 def catch_all_condition() -> Condition:
     def always_true(_: str) -> bool:
         return True
     return always_true
 
 
-# Common Conditions
+# Common Conditions, the factories are memoized so identical arguments share the same condition
 condition_ping = lower_match_factory('ping')
 condition_blue = lower_match_factory('blue')
 condition_catch_all = catch_all_condition()
@@ -1,172 +1,196 @@
 import os
+import time
 import logging
-from typing import List, Dict, Optional
+import functools
+from typing import List, Dict, Optional, Tuple, Any, Callable, Awaitable
 
-import requests
-from dotenv import load_dotenv
+import httpx
+from env import ensure_env
 from telegram import Update, WebAppInfo
-from telegram.ext import filters, MessageHandler, ContextTypes, CommandHandler, CallbackQueryHandler
+from telegram.ext import filters, MessageHandler, ContextTypes, CommandHandler, CallbackQueryHandler, Application
 from adapters.notion_adapter import NotionAdapter
 from bot.bot_actions import action_ping, action_reply_factory
-from bot.bot_common import reply_builder, allowed_user, TelegramBot
+from bot.bot_common import reply_builder, allowed_user, allowed_chat_ids, TelegramBot, broadcast
 from bot.bot_conditions import condition_ping, condition_catch_all
-from notes_bot import action_notes
+from notes_bot import action_notes, close_notion_client
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup
 
-load_dotenv()  # Python module to load environment variables from a .env file
-
-# Pythonic way of creating a list, behaves like a loop
-allowed_chat_ids: List[int] = [int(chat_id) for chat_id in os.getenv('ALLOWED_CHAT_IDS').split(',')]
+ensure_env()  # Loads environment variables from the .env file, once per process
 
 my_notion = NotionAdapter(os.getenv("NOTION_TOKEN"))
 
+# Shared HTTP client for the quote APIs, so fetches reuse pooled keep-alive connections
+# and don't block the event loop while waiting on the network
+http_client = httpx.AsyncClient(
+    timeout=30,
+    limits=httpx.Limits(max_keepalive_connections=10, max_connections=20),
+)
+
+
+async def close_http_client(application: Application):
+    await http_client.aclose()
+    await my_notion.aclose()
+    await close_notion_client(application)
+
+
+# Quotes move slowly during the day, so button presses and scheduled jobs within this window share one fetch
+QUOTE_CACHE_TTL_SECONDS = 120
 
-def get_mep_quote() -> Optional[float]:
+
+def async_ttl_cache(ttl: float):
+    # Memoizes a coroutine function by its positional arguments for ttl seconds.
+    # Failed fetches (an exception or a None result) are not cached, so the next call retries
+    def decorator(func):
+        cache: Dict[tuple, Tuple[float, Any]] = {}
+
+        @functools.wraps(func)
+        async def wrapper(*args):
+            now = time.monotonic()
+            cached = cache.get(args)
+            if cached is not None and now - cached[0] < ttl:
+                return cached[1]
+            value = await func(*args)
+            if value is not None:
+                cache[args] = (now, value)
+            return value
+        return wrapper
+    return decorator
+
+
+@async_ttl_cache(QUOTE_CACHE_TTL_SECONDS)
+async def get_mep_quote() -> Optional[float]:
     try:
-        response = requests.get("https://dolarapi.com/v1/dolares/bolsa", timeout=30)
+        response = await http_client.get("https://dolarapi.com/v1/dolares/bolsa")
         response.raise_for_status()
         mep_quote = response.json().get("venta")
         return mep_quote
-    except requests.RequestException as e:
+    except httpx.HTTPError as e:
         logging.error(f"Error fetching MEP quote: {e}")
         return None
 
 
 async def send_mep_message(bot: TelegramBot, chat_ids: List[int]):
-    mep_quote = get_mep_quote()
-    for chat_id in chat_ids:
-        if mep_quote is not None:
-            await bot.send_message(chat_id, f"Dolar MEP: {mep_quote}")
-        else:
-            await bot.send_message(chat_id, f"Problem retrieving MEP quote")
+    mep_quote = await get_mep_quote()
+    if mep_quote is not None:
+        await broadcast(bot, chat_ids, f"Dolar MEP: {mep_quote}")
+    else:
+        await broadcast(bot, chat_ids, "Problem retrieving MEP quote")
 
 
 
-def get_blue_quote():
-    response = requests.get("https://api.bluelytics.com.ar/v2/latest")
+@async_ttl_cache(QUOTE_CACHE_TTL_SECONDS)
+async def get_blue_quote():
+    response = await http_client.get("https://api.bluelytics.com.ar/v2/latest")
     blue_quotes = response.json().get("blue")
     return blue_quotes
 
 
 async def send_blue_message(bot: TelegramBot, chat_ids: List[int]):
-    blue_quotes = get_blue_quote()
-    for chat_id in chat_ids:
-        await bot.send_message(chat_id, f"Dolar Blue: {int(blue_quotes.get('value_buy'))} | {int(blue_quotes.get('value_sell'))}")
+    blue_quotes = await get_blue_quote()
+    await broadcast(bot, chat_ids, f"Dolar Blue: {int(blue_quotes.get('value_buy'))} | {int(blue_quotes.get('value_sell'))}")
 
 
-def get_fx_quote(base: str, target: str) -> float:
-    response = requests.get(f"https://anyapi.io/api/v1/exchange/rates?base={base}&apiKey={os.getenv('ANY_API_FX_KEY')}")
-    rate = response.json().get("rates").get(target)
-    return rate
+@async_ttl_cache(QUOTE_CACHE_TTL_SECONDS)
+async def get_fx_rates(base: str) -> Dict[str, float]:
+    # The endpoint returns every rate for the base currency, so all targets of a base share one cached fetch
+    response = await http_client.get("https://anyapi.io/api/v1/exchange/rates",
+                                     params={"base": base, "apiKey": os.getenv('ANY_API_FX_KEY')})
+    return response.json().get("rates")
+
+
+async def get_fx_quote(base: str, target: str) -> float:
+    rates = await get_fx_rates(base)
+    return rates.get(target)
 
 
 async def send_fx_quote(bot: TelegramBot, chat_ids: List[int], base, target):
-    fx_quote = get_fx_quote(base, target)
-    for chat_id in chat_ids:
-        await bot.send_message(chat_id, f"{base}/{target}: {round(fx_quote, 3)}")
+    fx_quote = await get_fx_quote(base, target)
+    await broadcast(bot, chat_ids, f"{base}/{target}: {round(fx_quote, 3)}")
+
+
+def static_text(text: str) -> Callable[[], Awaitable[str]]:
+    async def button_text() -> str:
+        return text
+    return button_text
+
 
+async def blue_text() -> str:
+    blue_quotes: Dict[str, float] = await get_blue_quote()
+    return f"Dolar Blue: {int(blue_quotes.get('value_buy'))} | {int(blue_quotes.get('value_sell'))}"
 
-async def send_gbp_usd_quote(bot: TelegramBot, chat_ids: List[int]):
-    gbp_usd_quote = get_fx_quote("GBP", "USD")
-    for chat_id in chat_ids:
-        await bot.send_message(chat_id, f"GBP/USD: {round(gbp_usd_quote, 3)}")
 
+async def mep_text() -> str:
+    mep_quote = await get_mep_quote()
+    return f"Dolar MEP: {mep_quote}"
 
-async def send_eur_usd_quote(bot: TelegramBot, chat_ids: List[int]):
-    eur_usd_quote = get_fx_quote("EUR", "USD")
-    for chat_id in chat_ids:
-        await bot.send_message(chat_id, f"EUR/USD: {round(eur_usd_quote, 3)}")
 
+def fx_text(base: str, target: str) -> Callable[[], Awaitable[str]]:
+    async def button_text() -> str:
+        fx_quote = await get_fx_quote(base, target)
+        return f"{base}/{target}: {round(fx_quote, 3)}"
+    return button_text
 
-async def send_gbp_eur_quote(bot: TelegramBot, chat_ids: List[int]):
-    gbp_eur_quote = get_fx_quote("GBP", "EUR")
-    for chat_id in chat_ids:
-        await bot.send_message(chat_id, f"GBP/EUR: {round(gbp_eur_quote, 3)}")
+
+# Maps each inline button's callback_data to the coroutine that builds its reply
+BUTTON_REPLIES: Dict[str, Callable[[], Awaitable[str]]] = {
+    "GPT3": static_text("Send me a message to get a GPT-3 response."),
+    "GPT4": static_text("Send me a message to get a GPT-4 response."),
+    "Summary": static_text("Send me a message to get a summary."),
+    "Blue": blue_text,
+    "pound": fx_text("GBP", "USD"),
+    "eurusd": fx_text("EUR", "USD"),
+    "eurgbp": fx_text("GBP", "EUR"),
+    "mep": mep_text,
+}
 
 
 async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
-    query_data = query.data
-
-    if query_data == "GPT3":
-        await query.message.reply_text("Send me a message to get a GPT-3 response.")
-    elif query_data == "GPT4":
-        await query.message.reply_text("Send me a message to get a GPT-4 response.")
-    elif query_data == "Summary":
-        await query.message.reply_text("Send me a message to get a summary.")
-    elif query_data == "Blue":
-        blue_quotes: Dict[str, float] = get_blue_quote()
-        await query.message.reply_text(f"Dolar Blue: {int(blue_quotes.get('value_buy'))} | {int(blue_quotes.get('value_sell'))}")
-    elif query_data == "pound":
-        gbp_usd_quote = get_fx_quote("GBP", "USD")
-        await query.message.reply_text(f"GBP/USD: {round(gbp_usd_quote, 3)}")
-    elif query_data == "eurusd":
-        eur_usd_quote = get_fx_quote("EUR", "USD")
-        await query.message.reply_text(f"EUR/USD: {round(eur_usd_quote, 3)}")
-    elif query_data == "eurgbp":
-        gbp_eur_quote = get_fx_quote("GBP", "EUR")
-        await query.message.reply_text(f"GBP/EUR: {round(gbp_eur_quote, 3)}")
-    elif query_data == "mep":
-        mep_quote = get_mep_quote()
-        await query.message.reply_text(f"Dolar MEP: {mep_quote}")
-    else:
-        await query.message.reply_text(f"Me no comprender")
+
+    button_reply = BUTTON_REPLIES.get(query.data)
+    text = await button_reply() if button_reply is not None else "Me no comprender"
+    await query.message.reply_text(text)
+
+
+WEBAPP_URL = "https://65001e1807d1233bfa244c1a--stirring-capybara-973814.netlify.app/series_chart_d3.html"
+
+# The menus are static, so they are built once at import and reused for every /start and scheduled draw
+_BUTTON_ROWS = [
+    [
+        InlineKeyboardButton("GPT-3", callback_data="GPT3"),
+        InlineKeyboardButton("GPT-4", callback_data="GPT4"),
+        InlineKeyboardButton("Summary", callback_data="Summary"),
+    ],
+    [
+        InlineKeyboardButton("Blue", callback_data="Blue"),
+        InlineKeyboardButton("Pound", callback_data="pound"),
+        InlineKeyboardButton("Mep", callback_data="mep"),
+    ],
+    [
+        InlineKeyboardButton("EUR", callback_data="eurusd"),
+        InlineKeyboardButton("EURGBP", callback_data="eurgbp"),
+    ],
+]
+# The reply to /start also offers the chart web app next to the EUR buttons
+BUTTONS_REPLY_MARKUP = InlineKeyboardMarkup(
+    _BUTTON_ROWS[:-1] + [_BUTTON_ROWS[-1] + [InlineKeyboardButton(text="Open Chart", web_app=WebAppInfo(url=WEBAPP_URL))]]
+)
+BUTTONS_MARKUP = InlineKeyboardMarkup(_BUTTON_ROWS)
 
 
 async def draw_buttons_reply(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if allowed_user(update):
-        logging.info(f"Drawing buttons for verified user")
-
-        webapp_url = url = "https://65001e1807d1233bfa244c1a--stirring-capybara-973814.netlify.app/series_chart_d3.html"
-        keyboard = [
-            [
-                InlineKeyboardButton("GPT-3", callback_data="GPT3"),
-                InlineKeyboardButton("GPT-4", callback_data="GPT4"),
-                InlineKeyboardButton("Summary", callback_data="Summary"),
-            ],
-            [
-                InlineKeyboardButton("Blue", callback_data="Blue"),
-                InlineKeyboardButton("Pound", callback_data="pound"),
-                InlineKeyboardButton("Mep", callback_data="mep"),
-            ],
-            [
-                InlineKeyboardButton("EUR", callback_data="eurusd"),
-                InlineKeyboardButton("EURGBP", callback_data="eurgbp"),
-                InlineKeyboardButton(text="Open Chart", web_app=WebAppInfo(url=webapp_url))
-            ],
-        ]
-
-        reply_markup = InlineKeyboardMarkup(keyboard)
+        logging.info("Drawing buttons for verified user")
 
         await update.message.reply_text(
-            "Choose an option:", reply_markup=reply_markup
+            "Choose an option:", reply_markup=BUTTONS_REPLY_MARKUP
         )
 
 
 async def draw_buttons(bot: TelegramBot, chat_ids: List[int]):
-    for chat_id in chat_ids:
-        logging.info(f"Drawing buttons for verified user")
-
-        keyboard = [
-            [
-                InlineKeyboardButton("GPT-3", callback_data="GPT3"),
-                InlineKeyboardButton("GPT-4", callback_data="GPT4"),
-                InlineKeyboardButton("Summary", callback_data="Summary"),
-            ],
-            [
-                InlineKeyboardButton("Blue", callback_data="Blue"),
-                InlineKeyboardButton("Pound", callback_data="pound"),
-                InlineKeyboardButton("Mep", callback_data="mep"),
-            ],
-            [
-                InlineKeyboardButton("EUR", callback_data="eurusd"),
-                InlineKeyboardButton("EURGBP", callback_data="eurgbp"),
-            ],
-        ]
-
-        reply_markup = InlineKeyboardMarkup(keyboard)
-
-        await bot.send_message(chat_id=chat_id, text="Choose an option:", reply_markup=reply_markup)
+    logging.info("Drawing buttons for verified user")
+
+    await broadcast(bot, chat_ids, "Choose an option:", reply_markup=BUTTONS_MARKUP)
 
 
 reply = reply_builder({
@@ -188,6 +212,7 @@ def run_dev_bot():
     logging.info("Starting DEV bot")
     handlers = [start_handler, ver_handler, echo_handler, callback_handler]
     bot = TelegramBot(token=token, handlers=handlers)
+    bot.application.post_shutdown = close_http_client
 
     timezone = 'America/Argentina/Buenos_Aires'
 
@@ -199,7 +224,7 @@ def run_dev_bot():
 
     schedules = ["5:00", "7:00", "12:00", "18:00"]
     for schedule in schedules:
-        bot.schedule_task(send_gbp_usd_quote, schedule, timezone, [bot, allowed_chat_ids])
+        bot.schedule_task(send_fx_quote, schedule, timezone, [bot, allowed_chat_ids, "GBP", "USD"])
 
     schedules = ["10:01", "13:01", "16:01", "19:01"]
     for schedule in schedules:
@@ -0,0 +1,11 @@
+from dotenv import load_dotenv
+
+_loaded = False
+
+
+# Every module calls this at import instead of load_dotenv(), so the .env file is only searched and parsed once per process
+def ensure_env() -> None:
+    global _loaded
+    if not _loaded:
+        load_dotenv()
+        _loaded = True
@@ -1,19 +1,30 @@
+import io
+import asyncio
 import logging
 import os
+from collections import OrderedDict
 from typing import List
 
-from dotenv import load_dotenv
+from env import ensure_env
 from telegram import Update
-from telegram.ext import filters, MessageHandler, ContextTypes, CommandHandler
+from telegram.ext import filters, MessageHandler, ContextTypes, CommandHandler, Application
 
 from adapters.gpt_adapter import OpenAI
-from adapters.whisper_adapter import transcribe_audio_file
+from adapters.whisper_adapter import transcribe_audio, aclose as close_whisper_client
 from bot.bot_actions import action_ping
 from bot.bot_common import allowed_user, bot_start, run_telegram_bot, reply_builder
 from bot.bot_conditions import first_chars_lower_factory, condition_ping, \
     condition_catch_all
 
-load_dotenv()  # Python module to load environment variables from a .env file
+ensure_env()  # Loads environment variables from the .env file, once per process
+
+# Telegram rejects messages over 4096 characters, this leaves some headroom
+TELEGRAM_MESSAGE_LIMIT = 4000
+
+# Transcripts keyed by Telegram's file_unique_id, which is stable across chats and forwards, so a repeated audio
+# skips the download and the Whisper upload. The summary request then hits the OpenAI adapter's response cache
+TRANSCRIPT_CACHE_SIZE = 128
+transcript_cache: "OrderedDict[str, List[str]]" = OrderedDict()
 
 my_open_ai = OpenAI()  # OpenAI is a custom class that works as a wrapper/adapter for OpenAI's GPT API
 
@@ -22,14 +33,15 @@ condition_gpt = first_chars_lower_factory(3, 'gpt')
 
 
 async def action_gpt4(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    logging.info(f"Answering with GPT4")
-    response = my_open_ai.answer_message(update.message.text[4:], model="gpt-4")
+    logging.info("Answering with GPT4")
+    # The OpenAI client is blocking, run it in a worker thread so the event loop keeps serving updates
+    response = await asyncio.to_thread(my_open_ai.answer_message, update.message.text[4:], model="gpt-4")
     await context.bot.send_message(chat_id=update.effective_chat.id, text=response)
 
 
 async def action_gpt3(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    logging.info(f"Answering with GPT3")
-    response = my_open_ai.answer_message(update.message.text[3:])
+    logging.info("Answering with GPT3")
+    response = await asyncio.to_thread(my_open_ai.answer_message, update.message.text[3:])
     await context.bot.send_message(chat_id=update.effective_chat.id, text=response)
 
 
@@ -49,37 +61,62 @@ reply = reply_builder({
 async def process_audio(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if allowed_user(update):
         my_open_ai.clear_messages()  # TODO improve treatment of message history
-        logging.info(f"Transcribing audio file from verified user")
+        logging.info("Transcribing audio file from verified user")
         if update.message.audio is not None:
             audio_file = update.message.audio  # Access the audio file
-            local_file_path = f"audio_files/{audio_file.file_name}"
+            file_name = audio_file.file_name
         elif update.message.voice is not None:
             audio_file = update.message.voice
-            local_file_path = f"audio_files/{audio_file.file_unique_id}.m4a"
+            file_name = f"{audio_file.file_unique_id}.m4a"
         else:
             raise Exception("No audio message attached in update as audio or voice")
 
-        # Download the audio file
-
-        file = await context.bot.get_file(file_id=audio_file.file_id)
-        await file.download_to_drive(local_file_path)  #
-
-        # Send the audio file to the OpenAI API endpoint
-        messages: List[str] = transcribe_audio_file(local_file_path)
-
-        # Send each message as a separate message
-        for message in messages:
-            await context.bot.send_message(chat_id=update.effective_chat.id, text=message)
+        messages = transcript_cache.get(audio_file.file_unique_id)
+        if messages is not None:
+            logging.info("Reusing cached transcription")
+            transcript_cache.move_to_end(audio_file.file_unique_id)
+        else:
+            # Download the audio file into memory, bot downloads are capped at 20MB so there is no need to go
+            # through disk
+            file = await context.bot.get_file(file_id=audio_file.file_id)
+            audio_data = io.BytesIO()
+            await file.download_to_memory(audio_data)
+
+            # Send the audio file to the OpenAI API endpoint, sentences come back packed up to Telegram's limit
+            messages = await transcribe_audio(audio_data, file_name, max_length=TELEGRAM_MESSAGE_LIMIT)
+            transcript_cache[audio_file.file_unique_id] = messages
+            if len(transcript_cache) > TRANSCRIPT_CACHE_SIZE:
+                transcript_cache.popitem(last=False)
+
+        async def send_transcript():
+            # One message at a time so they arrive in order
+            for message in messages:
+                await context.bot.send_message(chat_id=update.effective_chat.id, text=message)
 
         single_message: str = " ".join(messages)
-        response: str = my_open_ai.answer_message(
+        summary_prompt = (
             f'Please summarise the following message, keep the original language (if the text is in Spanish, '
             f'perform the summary in Spanish),'
             f'which will likely be spanish or english:"{single_message}" \n Your '
             f'answer should start with "SUMMARY:\n" (in the original language, so it would be "RESUMEN: for Spanish')
-        await context.bot.send_message(chat_id=update.effective_chat.id, text=f"{response}")
 
-        os.remove(local_file_path)
+        # The summary is requested (in a worker thread, the OpenAI client is blocking) while the transcript is
+        # being sent, so the user waits for the slower of the two instead of both
+        transcript_result, response = await asyncio.gather(
+            send_transcript(),
+            asyncio.to_thread(my_open_ai.answer_message, summary_prompt),
+            return_exceptions=True,
+        )
+        if isinstance(transcript_result, Exception):
+            logging.error("Error sending transcript: %s", transcript_result)
+        if isinstance(response, Exception):
+            logging.error("Error summarising transcript: %s", response)
+        else:
+            await context.bot.send_message(chat_id=update.effective_chat.id, text=f"{response}")
+
+
+async def close_clients(application: Application):
+    await close_whisper_client()
 
 
 def run_whisper_bot():
@@ -92,7 +129,8 @@ def run_whisper_bot():
 
     # Run the bot
     logging.info("Starting Whisper/GPT bot")
-    run_telegram_bot(os.getenv('TELEGRAM_BOT_TOKEN'), [start_handler, echo_handler, audio_handler])
+    run_telegram_bot(os.getenv('TELEGRAM_BOT_TOKEN'), [start_handler, echo_handler, audio_handler],
+                     post_shutdown=close_clients)
 
 
 if __name__ == '__main__':
@@ -1,26 +1,26 @@
 import os
 import logging
-from typing import List
-from dotenv import load_dotenv
+from env import ensure_env
 from telegram import Update
-from telegram.ext import filters, MessageHandler, ContextTypes, CommandHandler
+from telegram.ext import filters, MessageHandler, ContextTypes, CommandHandler, Application
 from adapters.notion_adapter import NotionAdapter
 from bot.bot_actions import action_ping, action_reply_factory
 from bot.bot_common import bot_start, run_telegram_bot, reply_builder
 from bot.bot_conditions import condition_ping, condition_catch_all
 
-load_dotenv()  # Python module to load environment variables from a .env file
-
-allowed_chat_ids: List[int] = [int(chat_id) for chat_id in os.getenv('ALLOWED_CHAT_IDS').split(
-    ',')]  # Pythonic way of creating a list, behaves like a loop
+ensure_env()  # Loads environment variables from the .env file, once per process
 
 my_notion = NotionAdapter(os.getenv("NOTION_TOKEN"))
 
 
+async def close_notion_client(application: Application):
+    await my_notion.aclose()
+
+
 async def action_notes(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
-        my_notion.add_block(parent_id=os.getenv("NOTION_PAGE_ID"), text=update.message.text,
-                            block_type="bulleted_list_item")
+        await my_notion.add_block(parent_id=os.getenv("NOTION_PAGE_ID"), text=update.message.text,
+                                  block_type="bulleted_list_item")
         await update.message.reply_text("Note stored")
     except Exception as e:
         logging.error(f"Error while adding block to Notion: {e}")
@@ -42,7 +42,8 @@ def run_notes_bot():
     echo_handler = MessageHandler(filters.TEXT & (~filters.COMMAND), reply)
 
     logging.info("Starting Notes bot")
-    run_telegram_bot(os.getenv('TELEGRAM_BOT_TOKEN'), [start_handler, ver_handler, echo_handler])
+    run_telegram_bot(os.getenv('TELEGRAM_BOT_TOKEN'), [start_handler, ver_handler, echo_handler],
+                     post_shutdown=close_notion_client)
 
 
 if __name__ == '__main__':
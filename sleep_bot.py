@@ -10,11 +10,13 @@
 
 import os
 import sys
+import asyncio
 import logging
 from datetime import datetime, timedelta, time
 import httpx
 from typing import Dict, Any, List, Optional
-from dotenv import load_dotenv, dotenv_values
+from dotenv import dotenv_values
+from env import ensure_env
 from telegram import Update
 from telegram.ext import (
     Application,
@@ -29,7 +31,7 @@ import uuid
 import argparse
 import pytz  # Add timezone support
 
-load_dotenv()
+ensure_env()
 
 # Configure root logger to be less verbose
 logging.basicConfig(level=logging.WARNING)  # This will affect third-party loggers
@@ -66,6 +68,19 @@ BACKEND_URL = 'http://localhost:8080' if args.local else 'https://sleep-tracker-
 backend_type = "LOCAL" if args.local else "REMOTE"
 logger.info(f"Using {backend_type} backend at: {BACKEND_URL}")
 
+# Shared HTTP client for the backend, so requests reuse pooled connections
+# instead of paying a new TCP+TLS handshake each time. HTTP/2 lets concurrent
+# handlers multiplex over one connection (falls back to HTTP/1.1 if unsupported)
+http_client = httpx.AsyncClient(
+    base_url=BACKEND_URL,
+    http2=True,
+    timeout=httpx.Timeout(10.0, connect=5.0),
+    limits=httpx.Limits(max_keepalive_connections=20, max_connections=100),
+)
+
+# Maximum number of pending entries submitted concurrently by /sync
+SYNC_CONCURRENCY = 10
+
 # Set timezone
 TIMEZONE = os.getenv('TZ', 'America/Argentina/Buenos_Aires')  # Use TZ from .env or default
 timezone = pytz.timezone(TIMEZONE)  # Ensure this is using pytz
@@ -78,12 +93,13 @@ env = os.getenv('ENVIRONMENT', 'dev').lower()
 logger.info(f"Starting bot in {env.upper()} environment")
 
 # Try .env first, then fall back to system environment
-allowed_chat_ids = [
+# A frozenset makes the per-update membership check in is_allowed_user O(1)
+allowed_chat_ids = frozenset(
     int(id) for id in (
         dot_env_vars.get('ALLOWED_CHAT_IDS') or 
         os.getenv('ALLOWED_CHAT_IDS', '')
-    ).split(',')
-]
+    ).split(',') if id.strip()
+)
 
 # Get bot token with environment-specific fallback
 bot_token = (
@@ -111,12 +127,12 @@ class BotMemoryCache:
     def add_pending_entry(self, entry: Dict[str, Any]):
         """Add an entry to pending when backend is unavailable"""
         self.pending_entries.append(entry)
-        logger.debug(f"Added entry to pending cache. Total pending: {len(self.pending_entries)}")
+        logger.debug("Added entry to pending cache. Total pending: %s", len(self.pending_entries))
     
     def update_last_known_entries(self, entries: List[Dict[str, Any]]):
         """Update the cache of last known entries from backend"""
         self.last_known_entries = entries
-        logger.debug(f"Updated last known entries cache. Total entries: {len(entries)}")
+        logger.debug("Updated last known entries cache. Total entries: %s", len(entries))
     
     def get_combined_history(self, limit: int = 5) -> List[Dict[str, Any]]:
         """Get combined history of pending and last known entries"""
@@ -129,7 +145,7 @@ class BotMemoryCache:
         """Clear pending entries after they've been synced"""
         count = len(self.pending_entries)
         self.pending_entries = []
-        logger.debug(f"Cleared {count} pending entries")
+        logger.debug("Cleared %s pending entries", count)
 
 # Initialize the memory cache as a global variable
 bot_memory = BotMemoryCache()
@@ -147,11 +163,11 @@ def is_allowed_user(update: Update) -> bool:
             return False
         
         allowed = chat_id in allowed_chat_ids
-        logger.debug(f"Chat ID {chat_id} allowed: {allowed}")
+        logger.debug("Chat ID %s allowed: %s", chat_id, allowed)
         return allowed
         
     except Exception as e:
-        logger.error(f"Error checking user permission: {e}")
+        logger.error("Error checking user permission: %s", e)
         return False
 
 def get_start_menu_keyboard():
@@ -212,7 +228,7 @@ async def send_rating_keyboard(update: Update, context: ContextTypes.DEFAULT_TYP
 async def check_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not is_allowed_user(update):
         return
-    logger.debug(f"Starting check-in for user {update.effective_chat.id}")
+    logger.debug("Starting check-in for user %s", update.effective_chat.id)
     await send_rating_keyboard(update, context, "on-demand")
 
 async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -254,29 +270,28 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         action = query.data.split("_")[1]
         if action == "confirm":
             try:
-                async with httpx.AsyncClient() as client:
-                    logger.debug("Attempting to delete last entry")
-                    response = await client.delete(f"{BACKEND_URL}/delete-last-entry")
-                    if response.status_code == 200:
-                        deleted_entry = response.json().get("deleted_entry", {})
-                        timestamp = deleted_entry.get("timestamp", "unknown time")
-                        checkin_type = deleted_entry.get("checkin_type", "unknown type")
-                        rating = deleted_entry.get("rating", "unknown rating")
-                        await query.edit_message_text(
-                            f"✅ Successfully deleted entry:\n"
-                            f"Time: {timestamp}\n"
-                            f"Type: {checkin_type}\n"
-                            f"Rating: {rating}"
-                        )
-                        # Show start menu after successful deletion
-                        await show_start_menu(query.message)
-                    else:
-                        error_detail = response.json().get("detail", "Unknown error")
-                        await query.edit_message_text(f"❌ Failed to delete last entry: {error_detail}")
-                        # Show start menu after error
-                        await show_start_menu(query.message)
+                logger.debug("Attempting to delete last entry")
+                response = await http_client.delete("/delete-last-entry")
+                if response.status_code == 200:
+                    deleted_entry = response.json().get("deleted_entry", {})
+                    timestamp = deleted_entry.get("timestamp", "unknown time")
+                    checkin_type = deleted_entry.get("checkin_type", "unknown type")
+                    rating = deleted_entry.get("rating", "unknown rating")
+                    await query.edit_message_text(
+                        f"✅ Successfully deleted entry:\n"
+                        f"Time: {timestamp}\n"
+                        f"Type: {checkin_type}\n"
+                        f"Rating: {rating}"
+                    )
+                    # Show start menu after successful deletion
+                    await show_start_menu(query.message)
+                else:
+                    error_detail = response.json().get("detail", "Unknown error")
+                    await query.edit_message_text(f"❌ Failed to delete last entry: {error_detail}")
+                    # Show start menu after error
+                    await show_start_menu(query.message)
             except Exception as e:
-                logger.error(f"Error deleting last entry: {e}")
+                logger.error("Error deleting last entry: %s", e)
                 await query.edit_message_text("❌ Error occurred while deleting entry.")
                 # Show start menu after error
                 await show_start_menu(query.message)
@@ -318,11 +333,10 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     context.user_data['last_entry_id'] = entry['id']
     
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.post(f"{BACKEND_URL}/submit", json=entry)
-            if response.status_code != 200:
-                raise Exception(f"Backend error: {response.status_code}")
-            logger.debug("Entry submitted to backend successfully")
+        response = await http_client.post("/submit", json=entry)
+        if response.status_code != 200:
+            raise Exception(f"Backend error: {response.status_code}")
+        logger.debug("Entry submitted to backend successfully")
         
         await query.edit_message_text(
             f"Recorded {checkin_type} drowsiness level: {rating}\n"
@@ -331,7 +345,7 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         
     except Exception as e:
-        logger.error(f"Error submitting entry: {e}")
+        logger.error("Error submitting entry: %s", e)
         # Always store in memory if submission fails
         bot_memory.add_pending_entry(entry)
         await query.edit_message_text(
@@ -363,40 +377,39 @@ async def add_note(update: Update, context: ContextTypes.DEFAULT_TYPE):
     note_text = ' '.join(context.args)
     entry_id = context.user_data['last_entry_id']
     
-    logger.debug(f"Adding note to entry {entry_id}: {note_text}")
+    logger.debug("Adding note to entry %s: %s", entry_id, note_text)
     
     # Get the current entry data
-    async with httpx.AsyncClient() as client:
-        try:
-            # First, get the entry data from history
-            response = await client.get(f"{BACKEND_URL}/history?limit=10")
-            if response.status_code != 200:
-                raise Exception("Failed to fetch entry data")
-            
-            entries = response.json()
-            entry = next((e for e in entries if e['id'] == entry_id), None)
-            
-            if not entry:
-                raise Exception("Entry not found")
-            
-            # Update the entry with the new note
-            entry['notes'] = note_text
-            
-            # Submit the update
-            update_response = await client.put(
-                f"{BACKEND_URL}/entry/{entry_id}",
-                json=entry
-            )
-            
-            if update_response.status_code == 200:
-                await update.message.reply_text("Note added successfully!")
-            else:
-                logger.error(f"Backend error response: {update_response.text}")
-                await update.message.reply_text("Error adding note. Please try again.")
-                
-        except Exception as e:
-            logger.error(f"Error adding note: {e}")
+    try:
+        # First, get the entry data from history
+        response = await http_client.get("/history?limit=10")
+        if response.status_code != 200:
+            raise Exception("Failed to fetch entry data")
+        
+        entries = response.json()
+        entry = next((e for e in entries if e['id'] == entry_id), None)
+        
+        if not entry:
+            raise Exception("Entry not found")
+        
+        # Update the entry with the new note
+        entry['notes'] = note_text
+        
+        # Submit the update
+        update_response = await http_client.put(
+            f"/entry/{entry_id}",
+            json=entry
+        )
+        
+        if update_response.status_code == 200:
+            await update.message.reply_text("Note added successfully!")
+        else:
+            logger.error("Backend error response: %s", update_response.text)
             await update.message.reply_text("Error adding note. Please try again.")
+            
+    except Exception as e:
+        logger.error("Error adding note: %s", e)
+        await update.message.reply_text("Error adding note. Please try again.")
 
 async def scheduled_reminder(context: ContextTypes.DEFAULT_TYPE):
     """Send scheduled reminders to all allowed users"""
@@ -410,7 +423,7 @@ async def scheduled_reminder(context: ContextTypes.DEFAULT_TYPE):
         f"(UTC: {current_time.astimezone(pytz.UTC).strftime('%H:%M:%S')})"
     )
     
-    logger.info(f"Sending {checkin_type} reminders")
+    logger.info("Sending %s reminders", checkin_type)
     
     for chat_id in allowed_chat_ids:
         try:
@@ -421,9 +434,9 @@ async def scheduled_reminder(context: ContextTypes.DEFAULT_TYPE):
             # Create a fake update object to reuse send_rating_keyboard
             fake_update = Update(0, message)
             await send_rating_keyboard(fake_update, context, checkin_type)
-            logger.debug(f"Sent {checkin_type} reminder to chat {chat_id}")
+            logger.debug("Sent %s reminder to chat %s", checkin_type, chat_id)
         except Exception as e:
-            logger.error(f"Failed to send {checkin_type} reminder to {chat_id}: {e}")
+            logger.error("Failed to send %s reminder to %s: %s", checkin_type, chat_id, e)
 
 async def history(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # Handle both Update and CallbackQuery objects
@@ -441,13 +454,12 @@ async def history(update: Update, context: ContextTypes.DEFAULT_TYPE):
     logger.debug("Fetching history")
     
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(f"{BACKEND_URL}/history?limit=5")
-            if response.status_code == 200:
-                entries = response.json()
-                bot_memory.update_last_known_entries(entries)
-            else:
-                raise Exception(f"Backend error: {response.status_code}")
+        response = await http_client.get("/history?limit=5")
+        if response.status_code == 200:
+            entries = response.json()
+            bot_memory.update_last_known_entries(entries)
+        else:
+            raise Exception(f"Backend error: {response.status_code}")
         
         # Get combined history from memory
         entries = bot_memory.get_combined_history(limit=5)
@@ -485,7 +497,7 @@ async def history(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await show_start_menu(message)
             
     except Exception as e:
-        logger.error(f"Error fetching history: {e}")
+        logger.error("Error fetching history: %s", e)
         # If we can't fetch from backend, just show what we have in memory
         entries = bot_memory.get_combined_history(limit=5)
         if not entries:
@@ -582,44 +594,51 @@ async def sync_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         f"🔄 Attempting to sync {len(bot_memory.pending_entries)} entries..."
     )
     
-    # Try to sync
-    async with httpx.AsyncClient() as client:
-        synced = 0
-        failed = 0
-        
-        for entry in bot_memory.pending_entries[:]:  # Create a copy to iterate
+    # Try to sync all entries concurrently, bounded to avoid exhausting the connection pool
+    semaphore = asyncio.Semaphore(SYNC_CONCURRENCY)
+
+    async def sync_entry(entry: Dict[str, Any]) -> bool:
+        async with semaphore:
             try:
-                response = await client.post(f"{BACKEND_URL}/submit", json=entry)
-                if response.status_code == 200:
-                    bot_memory.pending_entries.remove(entry)
-                    synced += 1
-                    logger.debug(f"Successfully synced entry from {entry['timestamp']}")
-                else:
-                    failed += 1
-                    logger.error(f"Failed to sync entry with status {response.status_code}")
+                response = await http_client.post("/submit", json=entry)
             except Exception as e:
-                failed += 1
-                logger.error(f"Failed to sync entry: {e}")
-        
-        # Update the message with results
-        if failed == 0:
-            await message.edit_text(f"✅ Successfully synced {synced} entries!")
-        else:
-            await message.edit_text(
-                f"📊 Sync results:\n"
-                f"✅ {synced} entries synced successfully\n"
-                f"❌ {failed} entries failed to sync\n\n"
-                f"Remaining pending entries: {len(bot_memory.pending_entries)}"
-            )
+                logger.error("Failed to sync entry: %s", e)
+                return False
+        if response.status_code != 200:
+            logger.error("Failed to sync entry with status %s", response.status_code)
+            return False
+        bot_memory.pending_entries.remove(entry)
+        logger.debug("Successfully synced entry from %s", entry['timestamp'])
+        return True
+
+    # Iterate over a copy, as synced entries are removed from the pending list
+    results = await asyncio.gather(*(sync_entry(entry) for entry in bot_memory.pending_entries[:]))
+    synced = sum(results)
+    failed = len(results) - synced
+    
+    # Update the message with results
+    if failed == 0:
+        await message.edit_text(f"✅ Successfully synced {synced} entries!")
+    else:
+        await message.edit_text(
+            f"📊 Sync results:\n"
+            f"✅ {synced} entries synced successfully\n"
+            f"❌ {failed} entries failed to sync\n\n"
+            f"Remaining pending entries: {len(bot_memory.pending_entries)}"
+        )
 
 async def time_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Respond with the current local time of the bot."""
     current_time = datetime.now(timezone).strftime('%Y-%m-%d %H:%M:%S')
     await update.message.reply_text(f"The current local time is: {current_time}")
 
+async def close_http_client(application: Application):
+    """Close the shared backend HTTP client on shutdown"""
+    await http_client.aclose()
+
 class TelegramBot:
     def __init__(self, token: str):
-        self.application = Application.builder().token(token).build()
+        self.application = Application.builder().token(token).post_shutdown(close_http_client).build()
         
         # Add handlers
         self.application.add_handler(CommandHandler('start', start))
@@ -671,9 +690,9 @@ class TelegramBot:
         for chat_id in allowed_chat_ids:
             try:
                 await context.bot.send_message(chat_id=chat_id, text=startup_message)
-                logger.info(f"Sent startup notification to chat {chat_id}")
+                logger.info("Sent startup notification to chat %s", chat_id)
             except Exception as e:
-                logger.error(f"Failed to send startup notification to {chat_id}: {e}")
+                logger.error("Failed to send startup notification to %s: %s", chat_id, e)
 
     def run(self):
         """Start the bot"""